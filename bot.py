@@ -1,15 +1,25 @@
 import discord
 from discord.ext import commands, tasks
+import asyncio
+import atexit
+import functools
 import os
 import json
 import logging
 import logging.handlers
+import queue
 from dotenv import load_dotenv
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from database import Database
-from r6_api import R6SAPIClient
+from r6_api import R6SAPIClient, install_fast_event_loop
 
 # Load environment variables
 load_dotenv()
@@ -33,22 +43,48 @@ file_formatter = logging.Formatter(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
 # Console handler
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 console_formatter = logging.Formatter('%(levelname)s - %(message)s')
 console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
+
+# Hand records to a background thread so file and console writes never block the event loop
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    file_handler,
+    console_handler,
+    respect_handler_level=True
+)
+log_listener.start()
+# Flush queued records on every exit path, including exit() during startup
+atexit.register(log_listener.stop)
+
+@dataclass(frozen=True)
+class Config:
+    """Bot settings from config.json and .env, resolved once at startup"""
+    guild_id: int
+    rate_limit_warning_threshold: float
+    rate_limit_stop_threshold: float
+    api_concurrency: int
+    role_update_concurrency: int
+    bot_commands_name: str
+    admin_logging_name: str
+    unlinked_name: str
+    unranked_name: str
+    database_path: str
+    tracker_api_key: str = field(repr=False)
+    discord_bot_token: Optional[str] = field(repr=False)
 
 # Load configuration
-def load_config():
+def load_config() -> Config:
     try:
-        with open('config.json', 'r') as f:
-            config = json.load(f)
-        logger.info("Config loaded successfully")
-        return config
+        with open('config.json', 'rb') as f:
+            raw = f.read()
+        config = orjson.loads(raw) if orjson else json.loads(raw)
     except json.JSONDecodeError:
         logger.error("config.json is not valid JSON")
         exit(1)
@@ -56,7 +92,34 @@ def load_config():
         logger.error("config.json not found")
         exit(1)
 
-CONFIG = load_config()
+    tracker_api_key = os.getenv('TRACKER_API_KEY')
+    if not tracker_api_key:
+        logger.error("TRACKER_API_KEY must be set in .env")
+        exit(1)
+
+    try:
+        cfg = Config(
+            guild_id=config['guild_id'],
+            rate_limit_warning_threshold=config['api']['rate_limit_warning_threshold'],
+            rate_limit_stop_threshold=config['api'].get('rate_limit_stop_threshold', 95),
+            api_concurrency=config['api'].get('concurrency', 8),
+            role_update_concurrency=config['updates'].get('role_update_concurrency', 5),
+            bot_commands_name=config['channels']['bot_commands_name'],
+            admin_logging_name=config['channels']['admin_logging_name'],
+            unlinked_name=config['roles']['unlinked_name'],
+            unranked_name=config['roles']['unranked_name'],
+            database_path=config['database']['path'],
+            tracker_api_key=tracker_api_key,
+            discord_bot_token=os.getenv('DISCORD_BOT_TOKEN'),
+        )
+    except KeyError as e:
+        logger.error(f"config.json is missing required key: {e}")
+        exit(1)
+
+    logger.info("Config loaded successfully")
+    return cfg
+
+CFG = load_config()
 
 # Initialize bot
 intents = discord.Intents.default()
@@ -66,25 +129,28 @@ intents.members = True
 bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
 
 # Initialize database and API
-db = Database(CONFIG['database']['path'])
-
-# Get Tracker Network API key
-tracker_api_key = os.getenv('TRACKER_API_KEY')
-
-if not tracker_api_key:
-    logger.error("TRACKER_API_KEY must be set in .env")
-    exit(1)
-
-api = R6SAPIClient(tracker_api_key)
+db = Database(CFG.database_path)
+api = R6SAPIClient(CFG.tracker_api_key)
 
 # Global variables
 bot_command_channel = None
 admin_logging_channel = None
 guild = None
 
-# Rank roles mapping
-RANKS = {
-    "unranked": "Unranked",
+# Role name -> Role lookup, kept in sync with the guild through role events
+ROLE_CACHE: Dict[str, discord.Role] = {}
+RANK_ROLE_IDS: FrozenSet[int] = frozenset()
+UNLINKED_ROLE: Optional[discord.Role] = None
+
+# Discord ID the next rank update starts from after one stopped at the rate limit
+rank_update_resume_id: Optional[int] = None
+
+# Text channel name -> TextChannel lookup, kept in sync through channel events
+CHANNEL_CACHE: Dict[str, discord.TextChannel] = {}
+
+# Rank roles mapping: specific (hidden) roles first, general (displayed) role last
+RANKS: Dict[str, Tuple[str, ...]] = {
+    "unranked": ("Unranked",),
     "bronze-3": ("Bronze 3", "Bronze"),
     "bronze-2": ("Bronze 2", "Bronze"),
     "bronze-1": ("Bronze 1", "Bronze"),
@@ -101,6 +167,13 @@ RANKS = {
     "champion": ("Champion", "Champion"),
 }
 
+# Every role name managed by the rank system
+ALL_RANK_ROLE_NAMES: FrozenSet[str] = frozenset(
+    name for names in RANKS.values() for name in names
+) | {CFG.unranked_name}
+
+_RANK_TRANS = str.maketrans(" ", "-")
+
 async def ensure_api_authenticated(ctx: Optional[commands.Context] = None) -> bool:
     """Ensure the Tracker Network API session is available before making requests."""
     if api.session and not api.session.closed:
@@ -129,7 +202,7 @@ async def log_to_admin(message: str):
 async def warn_rate_limit():
     """Warn in bot command channel if rate limit is approaching"""
     percentage = api.get_rate_limit_percentage()
-    if percentage >= CONFIG['api']['rate_limit_warning_threshold']:
+    if percentage >= CFG.rate_limit_warning_threshold:
         if bot_command_channel:
             embed = discord.Embed(
                 title="⚠️ Rate Limit Warning",
@@ -139,28 +212,76 @@ async def warn_rate_limit():
             await bot_command_channel.send(embed=embed)
         logger.warning(f"Rate limit at {percentage:.1f}%")
 
+def refresh_role_cache():
+    """Rebuild the role lookup cache from the guild's roles"""
+    ROLE_CACHE.clear()
+    if guild:
+        for role in guild.roles:
+            ROLE_CACHE.setdefault(role.name, role)
+    refresh_rank_role_ids()
+    refresh_unlinked_role()
+
+def refresh_rank_role_ids():
+    """Recompute the ids of all cached rank roles"""
+    global RANK_ROLE_IDS
+    RANK_ROLE_IDS = frozenset(
+        ROLE_CACHE[name].id for name in ALL_RANK_ROLE_NAMES if name in ROLE_CACHE
+    )
+
+def refresh_unlinked_role():
+    """Rebind the unlinked role from the role cache"""
+    global UNLINKED_ROLE
+    UNLINKED_ROLE = ROLE_CACHE.get(CFG.unlinked_name)
+
+def cache_role(role: discord.Role):
+    """Add a single role to the lookup cache"""
+    cached = ROLE_CACHE.get(role.name)
+    if cached is None or cached.id == role.id:
+        ROLE_CACHE[role.name] = role
+        if role.name in ALL_RANK_ROLE_NAMES:
+            refresh_rank_role_ids()
+        elif role.name == CFG.unlinked_name:
+            refresh_unlinked_role()
+
 async def get_or_create_role(name: str, is_hidden: bool = False) -> discord.Role:
     """Get or create a role"""
-    role = discord.utils.get(guild.roles, name=name)
+    role = ROLE_CACHE.get(name)
     if not role:
-        color = discord.Color.random()
-        role = await guild.create_role(
-            name=name,
-            color=color,
-            hoist=not is_hidden,
-            reason="R6 Bot Setup"
-        )
-        logger.info(f"Created role: {name}")
+        # The cache can miss a role that already exists (e.g. before on_ready has built it)
+        role = discord.utils.get(guild.roles, name=name)
+        if not role:
+            color = discord.Color.random()
+            role = await guild.create_role(
+                name=name,
+                color=color,
+                hoist=not is_hidden,
+                reason="R6 Bot Setup"
+            )
+            logger.info(f"Created role: {name}")
+        cache_role(role)
     return role
 
+def refresh_channel_cache():
+    """Rebuild the text channel lookup cache from the guild's channels"""
+    CHANNEL_CACHE.clear()
+    if guild:
+        for channel in guild.text_channels:
+            CHANNEL_CACHE.setdefault(channel.name, channel)
+
+def cache_channel(channel: discord.TextChannel):
+    """Add a single text channel to the lookup cache"""
+    cached = CHANNEL_CACHE.get(channel.name)
+    if cached is None or cached.id == channel.id:
+        CHANNEL_CACHE[channel.name] = channel
+
 async def get_or_create_channel(name: str, is_admin: bool = False) -> discord.TextChannel:
     """Get or create a text channel"""
-    channel = discord.utils.get(guild.text_channels, name=name)
+    channel = CHANNEL_CACHE.get(name)
     if not channel:
         overwrites = {}
         if is_admin:
             # Hide from @everyone but allow administrators to read and send
-            admin_role = discord.utils.get(guild.roles, name="Administrator")
+            admin_role = ROLE_CACHE.get("Administrator")
             overwrites[guild.default_role] = discord.PermissionOverwrite(read_messages=False)
             if admin_role:
                 overwrites[admin_role] = discord.PermissionOverwrite(
@@ -175,6 +296,7 @@ async def get_or_create_channel(name: str, is_admin: bool = False) -> discord.Te
             )
 
         channel = await guild.create_text_channel(name, overwrites=overwrites)
+        cache_channel(channel)
         logger.info(f"Created channel: {name}")
     return channel
 
@@ -182,63 +304,74 @@ def normalize_rank(rank_str: str) -> str:
     """Normalize rank string to lowercase with hyphens"""
     if not rank_str:
         return "unranked"
-    rank_lower = rank_str.lower().replace(" ", "-")
-    return rank_lower
+    return rank_str.lower().translate(_RANK_TRANS)
+
+@functools.lru_cache(maxsize=512)
+def rank_to_roles(rank_str: Optional[str]) -> Tuple[str, ...]:
+    """Resolve a rank string to the names of the roles it grants"""
+    if not rank_str:
+        return (CFG.unranked_name,)
+    return RANKS.get(normalize_rank(rank_str), ())
+
+def get_assignable_roles(member: discord.Member) -> list:
+    """Get a member's roles without @everyone, which cannot be assigned explicitly"""
+    return member.roles[1:]
+
+async def set_member_roles(member: discord.Member, current_roles: list, roles: list, reason: str):
+    """Replace a member's roles with a single Modify Guild Member request"""
+    unique_roles = {r.id: r for r in roles}
+    if unique_roles.keys() == {r.id for r in current_roles}:
+        return
+    await member.edit(roles=list(unique_roles.values()), reason=reason)
 
 async def assign_rank_roles(member: discord.Member, rank: Optional[str]):
     """Assign specific and general rank roles to a member"""
     try:
-        # Remove all rank roles first
-        for role_name in RANKS.values():
-            if isinstance(role_name, tuple):
-                role_names = role_name
-            else:
-                role_names = (role_name,)
-            
-            for rn in role_names:
-                role = discord.utils.get(guild.roles, name=rn)
-                if role and role in member.roles:
-                    await member.remove_roles(role)
+        # Keep every non-rank role
+        current_roles = get_assignable_roles(member)
+        new_roles = [r for r in current_roles if r.id not in RANK_ROLE_IDS]
         
-        # Assign new rank roles
-        if rank:
-            normalized = normalize_rank(rank)
-            if normalized in RANKS:
-                role_names = RANKS[normalized]
-                if isinstance(role_names, tuple):
-                    for role_name in role_names:
-                        role = await get_or_create_role(role_name, is_hidden=(role_name != role_names[-1]))
-                        await member.add_roles(role)
-                else:
-                    role = await get_or_create_role(role_names)
-                    await member.add_roles(role)
-        else:
-            # Unranked
-            unranked_role = await get_or_create_role(CONFIG['roles']['unranked_name'])
-            await member.add_roles(unranked_role)
+        # Add new rank roles
+        role_names = rank_to_roles(rank)
+        for i, role_name in enumerate(role_names):
+            role = await get_or_create_role(role_name, is_hidden=(i != len(role_names) - 1))
+            new_roles.append(role)
+        
+        await set_member_roles(member, current_roles, new_roles, reason="R6 rank update")
     except Exception as e:
         logger.error(f"Error assigning rank roles to {member}: {e}")
 
 async def remove_all_rank_roles(member: discord.Member):
     """Remove all rank roles from a member"""
     try:
-        for role_name in RANKS.values():
-            if isinstance(role_name, tuple):
-                role_names = role_name
-            else:
-                role_names = (role_name,)
-            
-            for rn in role_names:
-                role = discord.utils.get(guild.roles, name=rn)
-                if role and role in member.roles:
-                    await member.remove_roles(role)
+        current_roles = get_assignable_roles(member)
+        new_roles = [r for r in current_roles if r.id not in RANK_ROLE_IDS]
         
         # Add unlinked role
-        unlinked_role = await get_or_create_role(CONFIG['roles']['unlinked_name'])
-        await member.add_roles(unlinked_role)
+        new_roles.append(UNLINKED_ROLE or await get_or_create_role(CFG.unlinked_name))
+        
+        await set_member_roles(member, current_roles, new_roles, reason="R6 account unlinked")
     except Exception as e:
         logger.error(f"Error removing rank roles from {member}: {e}")
 
+async def assign_unlinked_role_to_guild(unlinked_role: discord.Role):
+    """Give the unlinked role to every unlinked guild member that is missing it"""
+    members = [member for member in guild.members if not member.bot]
+    linked_ids = db.get_linked_ids(member.id for member in members)
+    missing = [
+        member for member in members
+        if member.id not in linked_ids and not member.get_role(unlinked_role.id)
+    ]
+    
+    # One request per member, bounded to stay clear of Discord's rate limits
+    semaphore = asyncio.Semaphore(CFG.role_update_concurrency)
+    
+    async def add_unlinked_role(member: discord.Member):
+        async with semaphore:
+            await member.add_roles(unlinked_role, reason="R6 account not linked")
+    
+    await asyncio.gather(*(add_unlinked_role(member) for member in missing))
+
 @bot.event
 async def on_ready():
     """Bot startup validation"""
@@ -254,11 +387,15 @@ async def on_ready():
             exit(1)
     
     # Get guild
-    guild = bot.get_guild(CONFIG['guild_id'])
+    guild = bot.get_guild(CFG.guild_id)
     if not guild:
-        logger.error(f"Guild {CONFIG['guild_id']} not found")
+        logger.error(f"Guild {CFG.guild_id} not found")
         return
     
+    # Build the lookup caches as soon as guild is bound, since events use them from here on
+    refresh_role_cache()
+    refresh_channel_cache()
+    
     # Check admin permissions
     bot_member = guild.me
     if not bot_member.guild_permissions.administrator:
@@ -267,9 +404,15 @@ async def on_ready():
     
     logger.info("Bot has admin permissions")
     
+    # Make sure the unlinked role exists so events can use UNLINKED_ROLE directly
+    try:
+        await get_or_create_role(CFG.unlinked_name)
+    except discord.HTTPException as e:
+        logger.error(f"Could not create {CFG.unlinked_name} role: {e}")
+    
     # Check if channels and roles exist
-    bot_command_channel = discord.utils.get(guild.text_channels, name=CONFIG['channels']['bot_commands_name'])
-    admin_logging_channel = discord.utils.get(guild.text_channels, name=CONFIG['channels']['admin_logging_name'])
+    bot_command_channel = CHANNEL_CACHE.get(CFG.bot_commands_name)
+    admin_logging_channel = CHANNEL_CACHE.get(CFG.admin_logging_name)
     
     # Log startup
     startup_message = f"Bot started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
@@ -288,15 +431,53 @@ async def on_ready():
     if not hourly_update.is_running():
         hourly_update.start()
 
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    """Keep the role cache in sync with new roles"""
+    if guild and role.guild.id == guild.id:
+        cache_role(role)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    """Keep the role cache in sync with renamed roles"""
+    if guild and after.guild.id == guild.id and before.name != after.name:
+        refresh_role_cache()
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    """Drop deleted roles from the role cache"""
+    cached = ROLE_CACHE.get(role.name)
+    if guild and role.guild.id == guild.id and cached and cached.id == role.id:
+        refresh_role_cache()
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    """Keep the channel cache in sync with new text channels"""
+    if guild and channel.guild.id == guild.id and isinstance(channel, discord.TextChannel):
+        cache_channel(channel)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    """Keep the channel cache in sync with renamed text channels"""
+    if guild and after.guild.id == guild.id and before.name != after.name:
+        refresh_channel_cache()
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    """Drop deleted text channels from the channel cache"""
+    cached = CHANNEL_CACHE.get(channel.name)
+    if guild and channel.guild.id == guild.id and cached and cached.id == channel.id:
+        refresh_channel_cache()
+
 @bot.event
 async def on_member_join(member: discord.Member):
     """Assign roles when member joins"""
     global guild
     
-    if member.guild.id != CONFIG['guild_id']:
+    if member.guild.id != CFG.guild_id:
         return
     
-    user_data = db.get_user(member.id)
+    user_data = await db.aget_user(member.id)
     
     if user_data:
         # User is linked, assign rank roles
@@ -305,8 +486,7 @@ async def on_member_join(member: discord.Member):
         await log_to_admin(f"✅ Member {member} joined - restored rank: {cached_rank or 'Unranked'}")
     else:
         # User is not linked, assign unlinked role
-        unlinked_role = await get_or_create_role(CONFIG['roles']['unlinked_name'])
-        await member.add_roles(unlinked_role)
+        await member.add_roles(UNLINKED_ROLE or await get_or_create_role(CFG.unlinked_name))
         await log_to_admin(f"📝 Member {member} joined - assigned Unlinked role")
 
 @bot.command(name='setup')
@@ -315,39 +495,30 @@ async def setup(ctx):
     """Create all necessary roles and channels"""
     global guild, bot_command_channel, admin_logging_channel
     
-    if ctx.guild.id != CONFIG['guild_id']:
+    if ctx.guild.id != CFG.guild_id:
         await ctx.send("This command can only be used in the configured guild.")
         return
     
     guild = ctx.guild
+    refresh_role_cache()
+    refresh_channel_cache()
     
     try:
         # Create ranks roles
-        for rank_names in RANKS.values():
-            if isinstance(rank_names, tuple):
-                # Specific rank (hidden)
-                role = await get_or_create_role(rank_names[0], is_hidden=True)
-                # General rank (displayed)
-                role = await get_or_create_role(rank_names[1], is_hidden=False)
-            else:
-                role = await get_or_create_role(rank_names)
+        for role_names in RANKS.values():
+            # Specific ranks are hidden, the general rank is displayed
+            for i, role_name in enumerate(role_names):
+                await get_or_create_role(role_name, is_hidden=(i != len(role_names) - 1))
         
         # Create unlinked role
-        unlinked_role = await get_or_create_role(CONFIG['roles']['unlinked_name'])
+        unlinked_role = await get_or_create_role(CFG.unlinked_name)
         
         # Create channels
-        bot_command_channel = await get_or_create_channel(CONFIG['channels']['bot_commands_name'])
-        admin_logging_channel = await get_or_create_channel(CONFIG['channels']['admin_logging_name'], is_admin=True)
+        bot_command_channel = await get_or_create_channel(CFG.bot_commands_name)
+        admin_logging_channel = await get_or_create_channel(CFG.admin_logging_name, is_admin=True)
         
         # Assign unlinked role to all current members
-        for member in guild.members:
-            if member.bot:
-                continue
-            
-            user_data = db.get_user(member.id)
-            if not user_data:
-                if unlinked_role not in member.roles:
-                    await member.add_roles(unlinked_role)
+        await assign_unlinked_role_to_guild(unlinked_role)
         
         embed = discord.Embed(
             title="✅ Setup Complete",
@@ -362,6 +533,14 @@ async def setup(ctx):
         logger.error(f"Error in setup: {e}")
         await ctx.send(f"❌ Error during setup: {e}")
 
+YES_NO_ANSWERS = frozenset({'yes', 'no'})
+
+def yes_no_check(author_id: int):
+    """Build a wait_for check that accepts a yes/no reply from the given user"""
+    def check(message: discord.Message) -> bool:
+        return message.author.id == author_id and message.content.lower() in YES_NO_ANSWERS
+    return check
+
 @bot.command(name='link')
 async def link(ctx, *args):
     """Link user to R6 account. Usage: !link username or !link @user username (admin only)"""
@@ -426,7 +605,7 @@ async def link(ctx, *args):
         return
     
     # Check if target user is already linked
-    existing = db.get_user(target_user.id)
+    existing = await db.aget_user(target_user.id)
     if existing and existing[0] != r6_username:
         embed = discord.Embed(
             title="⚠️ Already Linked",
@@ -436,15 +615,12 @@ async def link(ctx, *args):
         embed.add_field(name="", value="Reply with `yes` or `no`", inline=False)
         await ctx.send(embed=embed)
         
-        def check(message):
-            return message.author == ctx.author and message.content.lower() in ['yes', 'no']
-        
         try:
-            response = await bot.wait_for('message', check=check, timeout=30)
+            response = await bot.wait_for('message', check=yes_no_check(ctx.author.id), timeout=30)
             if response.content.lower() != 'yes':
                 await ctx.send("Cancelled.")
                 return
-        except:
+        except asyncio.TimeoutError:
             await ctx.send("❌ Confirmation timed out.")
             return
     
@@ -452,8 +628,7 @@ async def link(ctx, *args):
     rank = await api.get_player_rank(r6_username)
     
     # Link user
-    db.link_user(target_user.id, r6_username)
-    db.update_rank(target_user.id, rank)
+    await db.alink_user(target_user.id, r6_username, rank)
     
     # Assign roles
     if ctx.guild:
@@ -500,7 +675,7 @@ async def unlink(ctx, user: Optional[discord.User] = None):
         return
     
     # Unlink user
-    db.unlink_user(target_user.id)
+    await db.aunlink_user(target_user.id)
     
     # Remove rank roles and assign unlinked role
     if ctx.guild:
@@ -568,7 +743,7 @@ async def stats(ctx, username: Optional[str] = None):
 async def update(ctx):
     """Manually trigger rank update for all users"""
     
-    if ctx.guild.id != CONFIG['guild_id']:
+    if ctx.guild.id != CFG.guild_id:
         return
     
     if ctx.guild:
@@ -618,41 +793,102 @@ async def hourly_update():
 
 async def run_rank_update() -> int:
     """Run the rank update logic"""
-    global guild
+    global guild, rank_update_resume_id
+    
+    start_id = rank_update_resume_id
+    rank_update_resume_id = None
+    # Rate limit figures are stale until a response in this run carries fresh headers
+    rate_limit_updates = api.rate_limit_updates
+    # Once the stop threshold is hit, workers drain the queue without calling the API
+    paused = False
+    resume_id: Optional[int] = None
+    in_flight = 0
+    
+    # Stream users from the database to a fixed pool of workers, so API
+    # requests start with the first row and concurrency respects the rate limit
+    changes: List[Tuple[int, Optional[str], Optional[str]]] = []
+    user_queue: asyncio.Queue = asyncio.Queue(maxsize=CFG.api_concurrency * 2)
+    
+    def skip_user(discord_id: int):
+        # The next run resumes from the lowest Discord ID this run did not look up
+        nonlocal resume_id
+        if resume_id is None or discord_id < resume_id:
+            resume_id = discord_id
+    
+    def quota_exhausted() -> bool:
+        usage = api.get_rate_limit_percentage()
+        if api.rate_limit_limit:
+            # Requests still in flight will use quota once they land
+            usage += in_flight * 100 / api.rate_limit_limit
+        return usage >= CFG.rate_limit_stop_threshold
+    
+    async def rank_worker():
+        nonlocal paused, in_flight
+        while True:
+            user = await user_queue.get()
+            if user is None:
+                return
+            
+            discord_id, r6_username, cached_rank = user
+            # Leave the rest of the API quota for commands
+            if not paused and api.rate_limit_updates != rate_limit_updates and quota_exhausted():
+                paused = True
+            if paused:
+                skip_user(discord_id)
+                continue
+            
+            # Get current rank from API and keep it if it changed
+            in_flight += 1
+            try:
+                current_rank = await api.get_player_rank(r6_username)
+            finally:
+                in_flight -= 1
+            if current_rank != cached_rank:
+                changes.append((discord_id, cached_rank, current_rank))
+    
+    workers = [asyncio.create_task(rank_worker()) for _ in range(CFG.api_concurrency)]
+    try:
+        async for user in db.aiter_users(start_id):
+            if paused:
+                skip_user(user[0])
+                break
+            await user_queue.put(user)
+    finally:
+        for _ in workers:
+            await user_queue.put(None)
+    await asyncio.gather(*workers)
+    
+    if resume_id is not None:
+        rank_update_resume_id = resume_id
+        await log_to_admin(
+            f"⚠️ Rank update paused at {api.get_rate_limit_percentage():.1f}% of the API rate limit; "
+            f"remaining users will be updated next run"
+        )
     
-    updated_count = 0
-    users = db.get_all_users()
+    # Update database in one transaction
+    await db.abulk_update_ranks([
+        (current_rank, discord_id) for discord_id, _, current_rank in changes
+    ])
     
-    for discord_id, r6_username, cached_rank in users:
-        # Get current rank from API
-        current_rank = await api.get_player_rank(r6_username)
-        
-        # Check if rank changed
-        if current_rank != cached_rank:
-            # Update database
-            db.update_rank(discord_id, current_rank)
-            updated_count += 1
-            
-            # Update member roles
-            member = guild.get_member(discord_id)
-            if member:
+    role_semaphore = asyncio.Semaphore(CFG.role_update_concurrency)
+    
+    async def apply_change(discord_id: int, cached_rank: Optional[str], current_rank: Optional[str]):
+        # Update member roles
+        member = guild.get_member(discord_id)
+        if member:
+            async with role_semaphore:
                 await assign_rank_roles(member, current_rank)
                 await log_to_admin(
                     f"📊 Updated {member} rank: {cached_rank or 'Unranked'} → {current_rank or 'Unranked'}"
                 )
     
-    # Check for unlinked members
-    for member in guild.members:
-        if member.bot:
-            continue
-        
-        if not db.user_exists(member.id):
-            # Check if they have the unlinked role
-            unlinked_role = discord.utils.get(guild.roles, name=CONFIG['roles']['unlinked_name'])
-            if unlinked_role and unlinked_role not in member.roles:
-                await member.add_roles(unlinked_role)
+    await asyncio.gather(*(apply_change(*change) for change in changes))
     
-    return updated_count
+    # Check for unlinked members missing the unlinked role
+    if UNLINKED_ROLE:
+        await assign_unlinked_role_to_guild(UNLINKED_ROLE)
+    
+    return len(changes)
 
 @bot.command(name='help')
 async def help_command(ctx):
@@ -738,9 +974,12 @@ async def before_hourly_update():
 
 # Run bot
 if __name__ == "__main__":
-    token = os.getenv('DISCORD_BOT_TOKEN')
-    if not token:
+    if not CFG.discord_bot_token:
         logger.error("DISCORD_BOT_TOKEN not found in .env")
         exit(1)
     
-    bot.run(token)
+    install_fast_event_loop()
+    try:
+        bot.run(CFG.discord_bot_token)
+    finally:
+        db.close()
@@ -1,84 +1,104 @@
+import asyncio
+import functools
 import sqlite3
 import logging
-from typing import Optional, List, Tuple
+import threading
+from typing import AsyncIterator, Iterable, Iterator, Optional, List, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Rows fetched per round trip when streaming users
+USER_BATCH_SIZE = 500
+
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        self._conn.execute('PRAGMA mmap_size=268435456')
         self.init_db()
+        
+        # In-memory copy of linked Discord IDs for O(1) existence checks
+        with self._lock:
+            self._linked_ids: Set[int] = {row[0] for row in self._conn.execute('SELECT discord_id FROM users')}
     
     def init_db(self):
         """Initialize database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Users table: Discord ID -> R6 username and cached rank
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                discord_id INTEGER PRIMARY KEY,
-                r6_username TEXT NOT NULL,
-                current_rank TEXT,
-                UNIQUE(r6_username)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info(f"Database initialized at {self.db_path}")
-    
-    def link_user(self, discord_id: int, r6_username: str) -> bool:
-        """Link a Discord user to an R6 account. If r6_username is already linked, unlink it first."""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if this R6 username is already linked to someone else
-            cursor.execute('SELECT discord_id FROM users WHERE r6_username = ?', (r6_username,))
-            result = cursor.fetchone()
-            if result and result[0] != discord_id:
-                # Unlink the old user
-                cursor.execute('DELETE FROM users WHERE r6_username = ?', (r6_username,))
-                logger.info(f"Unlinked Discord ID {result[0]} from R6 username {r6_username}")
+        with self._lock:
+            cursor = self._conn.cursor()
             
-            # Link the new user (insert or replace)
+            # Users table: Discord ID -> R6 username and cached rank
             cursor.execute('''
-                INSERT OR REPLACE INTO users (discord_id, r6_username, current_rank)
-                VALUES (?, ?, NULL)
-            ''', (discord_id, r6_username))
+                CREATE TABLE IF NOT EXISTS users (
+                    discord_id INTEGER PRIMARY KEY,
+                    r6_username TEXT NOT NULL,
+                    current_rank TEXT,
+                    UNIQUE(r6_username)
+                )
+            ''')
             
-            conn.commit()
-            conn.close()
+            self._conn.commit()
+        logger.info(f"Database initialized at {self.db_path}")
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+        logger.info("Database connection closed")
+    
+    def link_user(self, discord_id: int, r6_username: str, rank: Optional[str] = None) -> bool:
+        """Link a Discord user to an R6 account and cache their rank. If r6_username is already linked, unlink it first."""
+        try:
+            with self._lock:
+                cursor = self._conn.cursor()
+                
+                # Check if this R6 username is already linked to someone else
+                cursor.execute('SELECT discord_id FROM users WHERE r6_username = ?', (r6_username,))
+                result = cursor.fetchone()
+                displaced_id = result[0] if result and result[0] != discord_id else None
+                
+                # Link the new user. REPLACE removes any row conflicting on either
+                # discord_id or r6_username, which also unlinks the old owner
+                cursor.execute('''
+                    INSERT OR REPLACE INTO users (discord_id, r6_username, current_rank)
+                    VALUES (?, ?, ?)
+                ''', (discord_id, r6_username, rank))
+                
+                self._conn.commit()
+                self._linked_ids.discard(displaced_id)
+                self._linked_ids.add(discord_id)
+            if displaced_id is not None:
+                logger.info(f"Unlinked Discord ID {displaced_id} from R6 username {r6_username}")
             logger.info(f"Linked Discord ID {discord_id} to R6 username {r6_username}")
             return True
         except Exception as e:
             logger.error(f"Error linking user: {e}")
+            self._rollback()
             return False
     
     def unlink_user(self, discord_id: int) -> bool:
         """Unlink a Discord user from their R6 account"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM users WHERE discord_id = ?', (discord_id,))
-            conn.commit()
-            conn.close()
+            with self._lock:
+                self._conn.execute('DELETE FROM users WHERE discord_id = ?', (discord_id,))
+                self._conn.commit()
+                self._linked_ids.discard(discord_id)
             logger.info(f"Unlinked Discord ID {discord_id}")
             return True
         except Exception as e:
             logger.error(f"Error unlinking user: {e}")
+            self._rollback()
             return False
     
     def get_user(self, discord_id: int) -> Optional[Tuple[str, str]]:
         """Get R6 username and cached rank for a Discord user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT r6_username, current_rank FROM users WHERE discord_id = ?', (discord_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result
+            with self._lock:
+                cursor = self._conn.execute('SELECT r6_username, current_rank FROM users WHERE discord_id = ?', (discord_id,))
+                return cursor.fetchone()
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             return None
@@ -86,37 +106,62 @@ class Database:
     def get_all_users(self) -> List[Tuple[int, str, str]]:
         """Get all linked users"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT discord_id, r6_username, current_rank FROM users')
-            results = cursor.fetchall()
-            conn.close()
-            return results
+            with self._lock:
+                cursor = self._conn.execute('SELECT discord_id, r6_username, current_rank FROM users')
+                return cursor.fetchall()
         except Exception as e:
             logger.error(f"Error getting all users: {e}")
             return []
     
+    def _iter_user_batches(self, start_id: Optional[int], batch_size: int) -> Iterator[List[Tuple[int, str, str]]]:
+        """Yield linked users in batches of at most batch_size rows"""
+        try:
+            with self._lock:
+                cursor = self._conn.execute(
+                    'SELECT discord_id, r6_username, current_rank FROM users WHERE discord_id >= ? ORDER BY discord_id',
+                    (start_id if start_id is not None else -1,)
+                )
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+        except Exception as e:
+            logger.error(f"Error iterating users: {e}")
+    
     def update_rank(self, discord_id: int, rank: str) -> bool:
         """Update cached rank for a Discord user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET current_rank = ? WHERE discord_id = ?', (rank, discord_id))
-            conn.commit()
-            conn.close()
+            with self._lock:
+                self._conn.execute('UPDATE users SET current_rank = ? WHERE discord_id = ?', (rank, discord_id))
+                self._conn.commit()
             return True
         except Exception as e:
             logger.error(f"Error updating rank: {e}")
+            self._rollback()
+            return False
+    
+    def bulk_update_ranks(self, changes: List[Tuple[Optional[str], int]]) -> bool:
+        """Update cached ranks for many users in a single transaction. Takes (rank, discord_id) pairs."""
+        if not changes:
+            return True
+        try:
+            with self._lock:
+                self._conn.executemany('UPDATE users SET current_rank = ? WHERE discord_id = ?', changes)
+                self._conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error bulk updating ranks: {e}")
+            self._rollback()
             return False
     
     def get_rank(self, discord_id: int) -> Optional[str]:
         """Get cached rank for a Discord user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT current_rank FROM users WHERE discord_id = ?', (discord_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with self._lock:
+                cursor = self._conn.execute('SELECT current_rank FROM users WHERE discord_id = ?', (discord_id,))
+                result = cursor.fetchone()
             return result[0] if result else None
         except Exception as e:
             logger.error(f"Error getting rank: {e}")
@@ -124,13 +169,47 @@ class Database:
     
     def user_exists(self, discord_id: int) -> bool:
         """Check if a user is linked"""
+        return discord_id in self._linked_ids
+    
+    def get_linked_ids(self, discord_ids: Iterable[int]) -> Set[int]:
+        """Return the subset of the given Discord IDs that are linked"""
+        return {discord_id for discord_id in discord_ids if discord_id in self._linked_ids}
+    
+    async def _run(self, func, *args):
+        """Run a blocking database call in the default executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+    
+    async def alink_user(self, discord_id: int, r6_username: str, rank: Optional[str] = None) -> bool:
+        """Async wrapper for link_user"""
+        return await self._run(self.link_user, discord_id, r6_username, rank)
+    
+    async def aunlink_user(self, discord_id: int) -> bool:
+        """Async wrapper for unlink_user"""
+        return await self._run(self.unlink_user, discord_id)
+    
+    async def aget_user(self, discord_id: int) -> Optional[Tuple[str, str]]:
+        """Async wrapper for get_user"""
+        return await self._run(self.get_user, discord_id)
+    
+    async def aiter_users(self, start_id: Optional[int] = None, batch_size: int = USER_BATCH_SIZE) -> AsyncIterator[Tuple[int, str, str]]:
+        """Yield linked users ordered by Discord ID, starting at start_id, fetching each batch in the executor"""
+        batches = self._iter_user_batches(start_id, batch_size)
+        while True:
+            rows = await self._run(next, batches, None)
+            if rows is None:
+                return
+            for row in rows:
+                yield row
+    
+    async def abulk_update_ranks(self, changes: List[Tuple[Optional[str], int]]) -> bool:
+        """Async wrapper for bulk_update_ranks"""
+        return await self._run(self.bulk_update_ranks, changes)
+    
+    def _rollback(self):
+        """Discard a failed write so the shared connection stays usable"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT 1 FROM users WHERE discord_id = ?', (discord_id,))
-            exists = cursor.fetchone() is not None
-            conn.close()
-            return exists
+            with self._lock:
+                self._conn.rollback()
         except Exception as e:
-            logger.error(f"Error checking if user exists: {e}")
-            return False
+            logger.error(f"Error rolling back transaction: {e}")
@@ -1,18 +1,95 @@
+import asyncio
+import functools
+import json
 import logging
-from typing import Optional
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
 
 import aiohttp
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Profile lookups are cached briefly so repeated commands skip the network
+CACHE_TTL_SECONDS = 60.0
+CACHE_MAX_SIZE = 1024
+# Largest profile body we are willing to buffer; real payloads are a few hundred KB at most
+MAX_PROFILE_BYTES = 1 << 20
+# A 429 is retried this many times, waiting for Retry-After up to the cap below
+RATE_LIMIT_RETRIES = 1
+MAX_RETRY_AFTER_SECONDS = 5.0
+
+_PLATFORM_MAP = {
+    "pc": "uplay",
+    "xbox": "xbl",
+    "ps4": "psn",
+    "ps5": "psn"
+}
+_PROFILE_URL = "https://public-api.tracker.gg/v2/r6/standard/profile/{}/{}"
+
+# Stat keys that hold the season rank, in order of preference
+_RANK_KEYS = ("currentSeasonRank", "rankName", "rank", "overallRank")
+# Segments whose "ranked" category stats can stand in for a missing rank key.
+# Tracker's usual casings are listed so the common case skips str.lower()
+_SEASONAL_NAMES = frozenset({"seasonal", "Seasonal", "pvp", "PvP", "PVP"})
+_RANKED_CATEGORIES = frozenset({"ranked", "Ranked"})
+_EMPTY_DICT: dict = {}
+
+
+@functools.lru_cache(maxsize=16)
+def _platform_slug(platform: str) -> str:
+    """Map a user-facing platform name, in any casing, to Tracker's URL slug."""
+    return _PLATFORM_MAP.get(platform.lower(), "uplay")
+
+
+def install_fast_event_loop() -> bool:
+    """Make asyncio use uvloop (or winloop on Windows) when one is installed.
+
+    Must be called before the event loop is created, i.e. before asyncio.run()
+    or bot.run(). Returns True if a faster loop policy was installed.
+    """
+    try:
+        import uvloop as fast_loop
+    except ImportError:
+        try:
+            import winloop as fast_loop
+        except ImportError:
+            return False
+
+    asyncio.set_event_loop_policy(fast_loop.EventLoopPolicy())
+    logger.info("Using %s event loop", fast_loop.__name__)
+    return True
+
 
 class R6SAPIClient:
-    def __init__(self, api_key: str):
+    """Tracker Network client for Rainbow Six Siege profiles.
+
+    Can be used as an async context manager to open and close the session:
+
+        async with R6SAPIClient(api_key) as client:
+            rank = await client.get_player_rank("username")
+    """
+
+    def __init__(self, api_key: str, cache_ttl: float = CACHE_TTL_SECONDS, cache_size: int = CACHE_MAX_SIZE):
         self.api_key = api_key
         self.session: Optional[aiohttp.ClientSession] = None
         self.request_count = 0
         self.rate_limit_limit: Optional[int] = None
         self.rate_limit_remaining: Optional[int] = None
+        # Bumped whenever a response reports the remaining quota, so callers can tell fresh figures from stale ones
+        self.rate_limit_updates = 0
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # (platform slug, username) -> (stored at, value), least recently used first
+        self._rank_cache: "OrderedDict[Tuple[str, str], Tuple[float, Optional[str]]]" = OrderedDict()
+        self._valid_cache: "OrderedDict[Tuple[str, str], Tuple[float, bool]]" = OrderedDict()
+        # (platform slug, username) -> profile request currently in flight
+        self._inflight: Dict[Tuple[str, str], "asyncio.Future[Tuple[bool, Optional[str]]]"] = {}
 
     async def _handle_auth_failure(self, error: Exception) -> bool:
         """Log authentication errors with Tracker Network."""
@@ -24,7 +101,7 @@ class R6SAPIClient:
         return False
 
     async def authenticate(self) -> bool:
-        """Create a Tracker Network session."""
+        """Create a Tracker Network session. Does nothing if one is already open."""
         if not self.api_key:
             logger.error("TRACKER_API_KEY is not configured")
             return False
@@ -33,7 +110,17 @@ class R6SAPIClient:
             return True
 
         try:
+            # Keep warm TLS connections to Tracker and cache its DNS lookups
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                keepalive_timeout=75,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True
+            )
             self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30),
                 headers={
                     "TRN-Api-Key": self.api_key,
                     "Accept": "application/json",
@@ -43,7 +130,7 @@ class R6SAPIClient:
             logger.info("Initialized Tracker Network API session")
             return True
         except Exception as e:
-            logger.error(f"Failed to initialize Tracker Network session: {e}")
+            logger.error("Failed to initialize Tracker Network session: %s", e)
             return False
 
     async def close(self):
@@ -51,84 +138,143 @@ class R6SAPIClient:
         if self.session:
             try:
                 await self.session.close()
+                # Give the connector a loop iteration to finish closing its transports
+                await asyncio.sleep(0)
                 logger.info("Closed Tracker Network session")
             except Exception as e:
-                logger.error(f"Error closing session: {e}")
+                logger.error("Error closing session: %s", e)
 
-    async def get_player_rank(self, username: str, platform: str = "pc", retry: bool = True) -> Optional[str]:
-        """Get player's current rank"""
-        try:
-            if not self.session or self.session.closed:
-                return None
+    async def __aenter__(self) -> "R6SAPIClient":
+        await self.authenticate()
+        return self
 
-            self.request_count += 1
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
-            platform_map = {
-                "pc": "uplay",
-                "xbox": "xbl",
-                "ps4": "psn",
-                "ps5": "psn"
-            }
+    async def get_player_rank(self, username: str, platform: str = "pc", retry: bool = True) -> Optional[str]:
+        """Get player's current rank"""
+        cache_key = self._profile_key(username, platform)
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            try:
+                if not await self.authenticate():
+                    return None
 
-            platform_slug = platform_map.get(platform.lower(), "uplay")
-            url = f"https://public-api.tracker.gg/v2/r6/standard/profile/{platform_slug}/{username}"
+                hit, rank = self._cache_get(self._rank_cache, cache_key)
+                if hit:
+                    return rank
 
-            async with self.session.get(url) as response:
-                self._update_rate_limit(response)
+                _, rank = await self._fetch_profile(cache_key)
+                return rank
 
-                if response.status == 404:
-                    logger.debug(f"Player not found on Tracker Network: {username}")
-                    return None
+            except Exception as e:
+                if attempt + 1 < attempts and await self._handle_auth_failure(e):
+                    continue
 
-                if response.status >= 400:
-                    error_text = await response.text()
-                    raise RuntimeError(f"Tracker API error {response.status}: {error_text}")
+                logger.error("Error getting player rank for %s: %s", username, e)
+                return None
 
-                data = await response.json()
-                rank = self._extract_rank(data)
-                return rank if rank else "Unranked"
+    async def get_player_ranks(self, usernames: Iterable[str], platform: str = "pc", concurrency: int = 8) -> Dict[str, Optional[str]]:
+        """Get current ranks for several players, running up to `concurrency` lookups at once"""
+        semaphore = asyncio.Semaphore(concurrency)
 
-        except Exception as e:
-            if retry and await self._handle_auth_failure(e):
-                return await self.get_player_rank(username, platform, retry=False)
+        async def fetch(username: str) -> Tuple[str, Optional[str]]:
+            async with semaphore:
+                return username, await self.get_player_rank(username, platform)
 
-            logger.error(f"Error getting player rank for {username}: {e}")
-            return None
+        return dict(await asyncio.gather(*(fetch(username) for username in dict.fromkeys(usernames))))
 
     async def is_username_valid(self, username: str, platform: str = "pc", retry: bool = True) -> bool:
         """Check if a username exists"""
-        try:
-            if not self.session or self.session.closed:
-                logger.warning("Username validation requested before session was established")
-                return False
+        cache_key = self._profile_key(username, platform)
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            try:
+                if not await self.authenticate():
+                    logger.warning("Username validation requested without a Tracker Network session")
+                    return False
 
-            platform_map = {
-                "pc": "uplay",
-                "xbox": "xbl",
-                "ps4": "psn",
-                "ps5": "psn"
-            }
+                hit, valid = self._cache_get(self._valid_cache, cache_key)
+                if hit:
+                    return valid
 
-            platform_slug = platform_map.get(platform.lower(), "uplay")
-            url = f"https://public-api.tracker.gg/v2/r6/standard/profile/{platform_slug}/{username}"
+                found, _ = await self._fetch_profile(cache_key)
+                return found
+            except Exception as e:
+                if attempt + 1 < attempts and await self._handle_auth_failure(e):
+                    continue
 
+                logger.warning("Error validating username %s: %s", username, e)
+                return False
+
+    @staticmethod
+    def _profile_key(username: str, platform: str) -> Tuple[str, str]:
+        """Return the (platform slug, username) pair identifying a Tracker profile."""
+        return _platform_slug(platform), username
+
+    async def _fetch_profile(self, cache_key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+        """Fetch a Tracker profile, returning (found, rank). Concurrent calls for the same profile share one request."""
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._request_profile(cache_key))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda done: self._clear_inflight(cache_key, done))
+
+        # Shield so one caller being cancelled does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    def _clear_inflight(self, cache_key: Tuple[str, str], task: "asyncio.Future"):
+        """Forget a finished in-flight request."""
+        if self._inflight.get(cache_key) is task:
+            del self._inflight[cache_key]
+
+    async def _request_profile(self, cache_key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+        """Request a Tracker profile, returning (found, rank) and caching both."""
+        username = cache_key[1]
+        url = _PROFILE_URL.format(*cache_key)
+
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.request_count += 1
             async with self.session.get(url) as response:
                 self._update_rate_limit(response)
 
-                if response.status == 200:
-                    return True
+                if response.status == 429 and attempt < RATE_LIMIT_RETRIES:
+                    delay = self._retry_after(response)
+                elif response.status == 404:
+                    logger.debug("Player not found on Tracker Network: %s", username)
+                    found, rank = False, None
+                    break
+                elif response.status >= 400:
+                    error_text = await response.text()
+                    raise RuntimeError(f"Tracker API error {response.status}: {error_text}")
+                else:
+                    raw = await self._read_body(response)
+                    data = orjson.loads(raw) if orjson else json.loads(raw)
+                    found, rank = True, self._extract_rank(data) or "Unranked"
+                    break
 
-                if response.status == 404:
-                    return False
+            # Wait outside the response block so the connection goes back to the pool
+            logger.warning("Rate limited by Tracker Network; retrying %s in %.1fs", username, delay)
+            await asyncio.sleep(delay)
 
-                error_text = await response.text()
-                raise RuntimeError(f"Tracker API error {response.status}: {error_text}")
-        except Exception as e:
-            if retry and await self._handle_auth_failure(e):
-                return await self.is_username_valid(username, platform, retry=False)
+        self._cache_set(self._rank_cache, cache_key, rank)
+        self._cache_set(self._valid_cache, cache_key, found)
+        return found, rank
 
-            logger.warning(f"Error validating username {username}: {e}")
-            return False
+    @staticmethod
+    async def _read_body(response: aiohttp.ClientResponse) -> bytes:
+        """Read a response body, refusing anything larger than MAX_PROFILE_BYTES."""
+        if response.content_length is not None and response.content_length > MAX_PROFILE_BYTES:
+            raise RuntimeError(f"Tracker response too large: {response.content_length} bytes")
+
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_any():
+            size += len(chunk)
+            if size > MAX_PROFILE_BYTES:
+                raise RuntimeError(f"Tracker response exceeded {MAX_PROFILE_BYTES} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
 
     def get_similar_usernames(self, username: str, limit: int = 5) -> list:
         """Tracker Network search requires paid access; not supported here."""
@@ -147,41 +293,85 @@ class R6SAPIClient:
 
     def reset_request_count(self):
         """Reset request counter"""
-        logger.info(f"Resetting request count. Used {self.request_count} requests this cycle")
+        logger.info("Resetting request count. Used %d requests this cycle", self.request_count)
         self.request_count = 0
 
+    def _cache_get(self, cache: OrderedDict, key: Hashable) -> Tuple[bool, Any]:
+        """Return (hit, value) for a fresh cache entry, evicting it if expired."""
+        entry = cache.get(key)
+        if entry is None:
+            return False, None
+
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= self.cache_ttl:
+            del cache[key]
+            return False, None
+
+        cache.move_to_end(key)
+        return True, value
+
+    def _cache_set(self, cache: OrderedDict, key: Hashable, value: Any):
+        """Store a value, dropping the least recently used entries over capacity."""
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse) -> float:
+        """Return how long to wait before retrying a 429, capped at MAX_RETRY_AFTER_SECONDS."""
+        try:
+            delay = float(response.headers.get("Retry-After", "1"))
+        except ValueError:
+            # HTTP-date form or garbage; fall back to a short pause
+            delay = 1.0
+        return max(0.0, min(delay, MAX_RETRY_AFTER_SECONDS))
+
     def _update_rate_limit(self, response: aiohttp.ClientResponse):
         """Update rate limit counters from Tracker API headers."""
-        try:
-            limit_header = response.headers.get("X-RateLimit-Limit")
-            remaining_header = response.headers.get("X-RateLimit-Remaining")
+        headers = response.headers
+        limit_header = headers.get("X-RateLimit-Limit")
+        remaining_header = headers.get("X-RateLimit-Remaining")
 
-            if limit_header:
-                self.rate_limit_limit = int(limit_header)
-            if remaining_header:
-                self.rate_limit_remaining = int(remaining_header)
-        except Exception as e:
-            logger.debug(f"Unable to parse rate limit headers: {e}")
+        # Ignore malformed values instead of raising
+        if limit_header and limit_header.isdecimal():
+            self.rate_limit_limit = int(limit_header)
+        if remaining_header and remaining_header.isdecimal():
+            self.rate_limit_remaining = int(remaining_header)
+            self.rate_limit_updates += 1
 
     @staticmethod
     def _extract_rank(data: dict) -> Optional[str]:
         """Extract the current season rank from Tracker Network response."""
-        segments = data.get("data", {}).get("segments", [])
+        segments = (data.get("data") or _EMPTY_DICT).get("segments") or ()
         for segment in segments:
-            stats = segment.get("stats") or {}
+            stats = segment.get("stats")
+            if not stats:
+                continue
+            stats_get = stats.get
 
-            for key in ("currentSeasonRank", "rankName", "rank", "overallRank"):
-                stat = stats.get(key)
+            for key in _RANK_KEYS:
+                stat = stats_get(key)
                 if isinstance(stat, dict):
-                    value = stat.get("displayValue") or stat.get("metadata", {}).get("name") or stat.get("value")
+                    stat_get = stat.get
+                    value = (
+                        stat_get("displayValue")
+                        or ((metadata := stat_get("metadata")) and metadata.get("name"))
+                        or stat_get("value")
+                    )
                     if value:
                         return str(value)
 
-            metadata_name = (segment.get("metadata", {}).get("name") or "").lower()
-            if metadata_name in {"seasonal", "pvp"}:
+            segment_metadata = segment.get("metadata")
+            segment_name = segment_metadata.get("name") if segment_metadata else None
+            if segment_name and (segment_name in _SEASONAL_NAMES or segment_name.lower() in _SEASONAL_NAMES):
                 for stat in stats.values():
-                    if isinstance(stat, dict) and stat.get("displayCategory", "").lower() == "ranked":
-                        value = stat.get("displayValue") or stat.get("value")
+                    if not isinstance(stat, dict):
+                        continue
+                    stat_get = stat.get
+                    category = stat_get("displayCategory")
+                    if category and (category in _RANKED_CATEGORIES or category.lower() == "ranked"):
+                        value = stat_get("displayValue") or stat_get("value")
                         if value:
                             return str(value)
 